@@ -3,25 +3,167 @@
 Provide an endpoint for uploading and validating a net file.
 """
 
-import gzip
+import asyncio
 import hashlib
 import logging
-import re
+import mmap
+import os
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Annotated
+from typing import TYPE_CHECKING, Annotated, BinaryIO
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+from isal import isal_zlib
+
+if TYPE_CHECKING:
+    from hashlib import _Hash
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+NN_DIR = Path(__file__).resolve().parents[1] / "nn"
+# Plain string for os.open, avoid converting the Path on every upload
+NN_DIR_STR = os.fspath(NN_DIR)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncGenerator[None]:
+    """Ensure the nn directory exists before serving requests."""
+    NN_DIR.mkdir(exist_ok=True)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 UPLOAD = File(...)
 
+# The success response never changes, serialize it once.
+UPLOAD_SUCCESS_BODY = b'{"detail":"File uploaded successfully"}'
+
+# Net filenames are "nn-" + the first 12 hex digits of the SHA-256 + ".nnue".
+NET_FILE_PREFIX = "nn-"
+NET_FILE_SUFFIX = ".nnue"
+NET_HASH_SLICE = slice(len(NET_FILE_PREFIX), len(NET_FILE_PREFIX) + 12)
+NET_FILE_LENGTH = NET_HASH_SLICE.stop + len(NET_FILE_SUFFIX)
+
+# Reject larger request bodies before they are read, nets are well below this.
+MAX_UPLOAD_SIZE = 256 * 1024 * 1024
+
+# Hash and compress the upload in fixed-size chunks to stay cache friendly.
+CHUNK_SIZE = 64 * 1024
+# NNUE weights compress poorly past level 1 (ISA-L range is 0-3), higher
+# levels only burn CPU.
+COMPRESS_LEVEL = 1
+# Let ISA-L emit the gzip header and trailer, including the CRC32.
+GZIP_WBITS = 31
+
+
+def parse_net_hash(net_file: str) -> bytes | None:
+    """Return the hash bytes encoded in a net filename, or None if it is invalid."""
+    if (
+        len(net_file) != NET_FILE_LENGTH
+        or not net_file.startswith(NET_FILE_PREFIX)
+        or not net_file.endswith(NET_FILE_SUFFIX)
+    ):
+        return None
+    hex_hash = net_file[NET_HASH_SLICE]
+    try:
+        net_hash = bytes.fromhex(hex_hash)
+    except ValueError:
+        return None
+    # fromhex also accepts uppercase digits and whitespace, reject them
+    return net_hash if net_hash.hex() == hex_hash else None
+
+
+def write_all(fd: int, data: bytes) -> None:
+    """Write all data to the file descriptor, retrying on short writes."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def ingest_upload(
+    src: BinaryIO,
+    fd: int,
+    hasher: "_Hash",
+    compressor: isal_zlib.Compress,
+) -> None:
+    """Hash and compress the uploaded net, writing it to the file descriptor.
+
+    The upload is memory mapped so the hasher and the compressor read the same
+    pages in place, without copying each chunk into a bytes object.
+    """
+    # fileno() spills an in-memory upload to its temporary file
+    size = os.fstat(src.fileno()).st_size
+    if size:
+        with (
+            mmap.mmap(src.fileno(), size, access=mmap.ACCESS_READ) as mm,
+            memoryview(mm) as view,
+        ):
+            # Bind the per-chunk calls once, the loop then uses fast local lookups
+            update, compress = hasher.update, compressor.compress
+            for start in range(0, size, CHUNK_SIZE):
+                with view[start : start + CHUNK_SIZE] as chunk:
+                    update(chunk)
+                    write_all(fd, compress(chunk))
+    write_all(fd, compressor.flush())
+
+
+def store_net(src: BinaryIO, net_file_gz: str, expected_hash: bytes) -> bool:
+    """Store the compressed net in the nn directory if its hash is valid.
+
+    Write to an anonymous file and link it into place only once verified, so the
+    nn directory never holds a partial or invalid net. Return False on a hash
+    mismatch, raise FileExistsError if the net is already stored.
+
+    All the file IO is blocking, run it in a worker thread. Both OpenSSL and ISA-L
+    release the GIL on large buffers, so concurrent uploads hash and compress in
+    parallel.
+    """
+    # Hash the raw net while it is being written, no second pass over the file
+    hasher = hashlib.sha256(usedforsecurity=False)
+    dir_fd = os.open(NN_DIR_STR, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fd = os.open(".", os.O_TMPFILE | os.O_WRONLY, 0o644, dir_fd=dir_fd)
+        try:
+            compressor = isal_zlib.compressobj(
+                COMPRESS_LEVEL,
+                isal_zlib.DEFLATED,
+                GZIP_WBITS,
+            )
+            ingest_upload(src, fd, hasher, compressor)
+            if hasher.digest()[: len(expected_hash)] != expected_hash:
+                return False
+            # With a dir_fd os.link uses linkat(AT_SYMLINK_FOLLOW), which links
+            # the file behind the /proc magic symlink
+            os.link(f"/proc/self/fd/{fd}", net_file_gz, dst_dir_fd=dir_fd)
+        finally:
+            os.close(fd)
+    finally:
+        os.close(dir_fd)
+    return True
+
+
+@app.middleware("http")
+async def limit_upload_size(
+    request: Request,
+    call_next: Callable[[Request], Awaitable[Response]],
+) -> Response:
+    """Reject requests whose declared body size exceeds MAX_UPLOAD_SIZE."""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE:
+        detail = f"Request body exceeds {MAX_UPLOAD_SIZE} bytes"
+        logger.error(detail)
+        return JSONResponse(
+            status_code=413,
+            content={"detail": detail},
+        )
+    return await call_next(request)
+
 
 @app.post("/upload_net/", status_code=201)
-async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> JSONResponse:
+async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> Response:
     """Upload a net file to the server and validate its hash."""
     net_file = upload.filename
     if not net_file:
@@ -31,7 +173,8 @@ async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> JSONRespon
             status_code=400,
             detail=detail,
         )
-    if not re.match(r"^nn-[0-9a-f]{12}\.nnue$", net_file):
+    expected_hash = parse_net_hash(net_file)
+    if expected_hash is None:
         detail = (
             f"Filename {net_file} does not match expected pattern "
             f"(nn-[0-9a-f]{{12}}.nnue)"
@@ -42,23 +185,22 @@ async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> JSONRespon
             detail=detail,
         )
 
-    # Ensure the nn directory exists
-    nn_dir = Path(__file__).parents[1] / "nn"
-    nn_dir.mkdir(exist_ok=True)
-    net_file_gz = nn_dir / f"{net_file}.gz"
-
     try:
-        with gzip.open(net_file_gz, "xb") as f:
-            f.write(await upload.read())
+        valid_hash = await asyncio.to_thread(
+            store_net,
+            upload.file,
+            f"{net_file}.gz",
+            expected_hash,
+        )
     except FileExistsError as e:
         detail = f"File {net_file} already uploaded"
-        logger.exception(detail)
+        # A duplicate upload is expected, skip formatting the traceback
+        logger.error(detail)  # noqa: TRY400
         raise HTTPException(
             status_code=409,
             detail=detail,
         ) from e
     except Exception as e:
-        net_file_gz.unlink(missing_ok=True)
         detail = f"Failed to write file {net_file}"
         logger.exception(detail)
         raise HTTPException(
@@ -66,21 +208,7 @@ async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> JSONRespon
             detail=detail,
         ) from e
 
-    try:
-        net_data = gzip.decompress(net_file_gz.read_bytes())
-    except Exception as e:
-        net_file_gz.unlink()
-        detail = f"Failed to read uploaded file {net_file}"
-        logger.exception(detail)
-        raise HTTPException(
-            status_code=500,
-            detail=detail,
-        ) from e
-
-    net_hash = hashlib.sha256(net_data).hexdigest()[:12]
-
-    if net_hash != net_file[3:15]:
-        net_file_gz.unlink()
+    if not valid_hash:
         detail = f"Invalid hash for uploaded file {net_file}"
         logger.error(detail)
         raise HTTPException(
@@ -88,7 +216,8 @@ async def create_upload_net(upload: Annotated[UploadFile, UPLOAD]) -> JSONRespon
             detail=detail,
         )
 
-    return JSONResponse(
+    return Response(
         status_code=201,
-        content={"detail": "File uploaded successfully"},
+        content=UPLOAD_SUCCESS_BODY,
+        media_type="application/json",
     )
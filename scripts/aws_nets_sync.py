@@ -7,7 +7,6 @@ This script offers two modes:
 """
 
 import argparse
-import gzip
 import hashlib
 import logging
 import os
@@ -20,6 +19,8 @@ from dataclasses import dataclass, field
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+from isal import igzip
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
 
@@ -86,13 +87,14 @@ def get_required_env_var(key: str, *, expand: bool = False) -> str:
 
 
 def is_valid_net_hash(net: Path) -> bool:
-    """Check if the net file has a valid hash by reading and decompressing inline."""
+    """Check if the net file has a valid hash by streaming the decompressed data."""
     try:
-        net_data = gzip.decompress(net.read_bytes())
+        with igzip.open(net, "rb") as f:
+            hasher = hashlib.file_digest(f, "sha256")
     except Exception:
         logger.exception("Exception reading/decompressing the net %s", net)
         return False
-    net_hash = hashlib.sha256(net_data).hexdigest()[:12]
+    net_hash = hasher.hexdigest()[:12]
     return net_hash == net.name[3:15]
 
 
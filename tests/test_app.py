@@ -15,14 +15,17 @@ import pytest
 import pytest_asyncio
 from fastapi import HTTPException, UploadFile
 from httpx import ASGITransport, AsyncClient
+from isal import isal_zlib
 
-from app.main import app, create_upload_net
+from app import main
+from app.main import CHUNK_SIZE, app, create_upload_net, parse_net_hash
 
 # Constants for HTTP status codes.
 HTTP_CREATED = 201
 HTTP_BAD_REQUEST = 400
 HTTP_UNPROCESSABLE_ENTITY = 422
 HTTP_CONFLICT = 409
+HTTP_CONTENT_TOO_LARGE = 413
 HTTP_INTERNAL_SERVER_ERROR = 500
 
 
@@ -52,11 +55,14 @@ def ensure_clean_nn_file(filename: str) -> Path:
 
 @pytest_asyncio.fixture
 async def async_client() -> AsyncGenerator[AsyncClient]:
-    """Create an async client for the FastAPI app."""
-    async with AsyncClient(
-        transport=ASGITransport(app=app),
-        base_url="http://test",
-    ) as client:
+    """Create an async client for the FastAPI app, running its lifespan."""
+    async with (
+        app.router.lifespan_context(app),
+        AsyncClient(
+            transport=ASGITransport(app=app),
+            base_url="http://test",
+        ) as client,
+    ):
         yield client
 
 
@@ -112,36 +118,18 @@ async def test_upload_failed_write(
 ) -> None:
     """Test that a write failure returns an internal server error."""
 
-    def mock_open(*args: Any, **kwargs: Any) -> Never:
+    def mock_compressobj(*args: Any, **kwargs: Any) -> Never:
         write_failure_msg = "Mocked write failure"
         raise RuntimeError(write_failure_msg)
 
-    monkeypatch.setattr(gzip, "open", mock_open)
+    monkeypatch.setattr(isal_zlib, "compressobj", mock_compressobj)
     filename, net_file = create_net_file(correct_hash=True)
+    file_path = ensure_clean_nn_file(filename)
     files = {"upload": (filename, net_file, "application/gzip")}
     response = await async_client.post("/upload_net/", files=files)
     assert response.status_code == HTTP_INTERNAL_SERVER_ERROR
     assert response.json() == {"detail": f"Failed to write file {filename}"}
-
-
-@pytest.mark.asyncio
-async def test_upload_failed_read(
-    monkeypatch: pytest.MonkeyPatch,
-    async_client: AsyncClient,
-) -> None:
-    """Test that a read failure returns an internal server error."""
-
-    def mock_decompress(*args: Any, **kwargs: Any) -> Never:
-        decompress_failure_msg = "Mocked read failure"
-        raise RuntimeError(decompress_failure_msg)
-
-    monkeypatch.setattr(gzip, "decompress", mock_decompress)
-    filename, net_file = create_net_file(correct_hash=True)
-    _ = ensure_clean_nn_file(filename)
-    files = {"upload": (filename, net_file, "application/gzip")}
-    response = await async_client.post("/upload_net/", files=files)
-    assert response.status_code == HTTP_INTERNAL_SERVER_ERROR
-    assert response.json() == {"detail": f"Failed to read uploaded file {filename}"}
+    assert not file_path.exists()
 
 
 @pytest.mark.asyncio
@@ -149,8 +137,7 @@ async def test_upload_failed_read(
 async def test_upload_net(correct_hash: bool, async_client: AsyncClient) -> None:
     """Test uploading a net file with a correct or incorrect hash in the filename."""
     filename, net_file = create_net_file(correct_hash=correct_hash)
-    if correct_hash:
-        ensure_clean_nn_file(filename)
+    file_path = ensure_clean_nn_file(filename)
     files = {"upload": (filename, net_file, "application/gzip")}
     response = await async_client.post("/upload_net/", files=files)
     if correct_hash:
@@ -160,6 +147,7 @@ async def test_upload_net(correct_hash: bool, async_client: AsyncClient) -> None
         invalid_hash_msg = f"Invalid hash for uploaded file {filename}"
         assert response.status_code == HTTP_INTERNAL_SERVER_ERROR
         assert response.json() == {"detail": invalid_hash_msg}
+        assert not file_path.exists()
 
 
 @pytest.mark.asyncio
@@ -180,3 +168,63 @@ async def test_upload_net_with_existing_file_removal(async_client: AsyncClient)
     assert response.json() == {"detail": f"File {filename} already uploaded"}
     # Verify that the original file remains unchanged.
     assert file_path.read_bytes() == original_content
+
+
+@pytest.mark.asyncio
+async def test_upload_net_multiple_chunks(async_client: AsyncClient) -> None:
+    """Test that a net larger than one read chunk is stored intact."""
+    net_data = bytes(range(256)) * (3 * CHUNK_SIZE // 256 + 1)
+    filename = f"nn-{hashlib.sha256(net_data).hexdigest()[:12]}.nnue"
+    file_path = ensure_clean_nn_file(filename)
+    files = {"upload": (filename, io.BytesIO(net_data), "application/gzip")}
+    response = await async_client.post("/upload_net/", files=files)
+    assert response.status_code == HTTP_CREATED
+    assert gzip.decompress(file_path.read_bytes()) == net_data
+
+
+@pytest.mark.parametrize(
+    "filename",
+    [
+        "nn-0123456789ab.nnue.gz",
+        "nn-0123456789AB.nnue",
+        "nn-0123456789ag.nnue",
+        "nn-01234567 9ab.nnue",
+        "xx-0123456789ab.nnue",
+        "nn-0123456789ab.nnux",
+    ],
+)
+def test_parse_net_hash_invalid(filename: str) -> None:
+    """Test that malformed net filenames are rejected."""
+    assert parse_net_hash(filename) is None
+
+
+def test_parse_net_hash_valid() -> None:
+    """Test that the hash bytes are extracted from a valid net filename."""
+    assert parse_net_hash("nn-0123456789ab.nnue") == bytes.fromhex("0123456789ab")
+
+
+@pytest.mark.asyncio
+async def test_upload_empty_net(async_client: AsyncClient) -> None:
+    """Test that an empty net, which cannot be memory mapped, is stored."""
+    filename = f"nn-{hashlib.sha256(b'').hexdigest()[:12]}.nnue"
+    file_path = ensure_clean_nn_file(filename)
+    files = {"upload": (filename, io.BytesIO(b""), "application/gzip")}
+    response = await async_client.post("/upload_net/", files=files)
+    assert response.status_code == HTTP_CREATED
+    assert gzip.decompress(file_path.read_bytes()) == b""
+
+
+@pytest.mark.asyncio
+async def test_upload_too_large(
+    monkeypatch: pytest.MonkeyPatch,
+    async_client: AsyncClient,
+) -> None:
+    """Test that a body larger than the upload limit is rejected upfront."""
+    monkeypatch.setattr(main, "MAX_UPLOAD_SIZE", 16)
+    filename, net_file = create_net_file(correct_hash=True)
+    file_path = ensure_clean_nn_file(filename)
+    files = {"upload": (filename, net_file, "application/gzip")}
+    response = await async_client.post("/upload_net/", files=files)
+    assert response.status_code == HTTP_CONTENT_TOO_LARGE
+    assert response.json() == {"detail": "Request body exceeds 16 bytes"}
+    assert not file_path.exists()